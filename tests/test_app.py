@@ -6,6 +6,10 @@ import unittest
 import json
 import os
 import sys
+import time
+import queue
+import threading
+from functools import partial
 import pandas as pd
 import numpy as np
 from unittest.mock import patch, MagicMock
@@ -13,7 +17,7 @@ from unittest.mock import patch, MagicMock
 # Add the parent directory to the path to import app
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app import app
+from app import app, clear_caches, prepare_preprocessors
 
 class TestFlaskApp(unittest.TestCase):
     """Test cases for Flask application"""
@@ -22,6 +26,12 @@ class TestFlaskApp(unittest.TestCase):
         """Set up test client"""
         self.app = app.test_client()
         self.app.testing = True
+        clear_caches()
+        
+        # app loads any trained artifacts at import; route predictions to the patched model
+        runtimes = patch.multiple('app', onnx_session=None, treelite_predictor=None)
+        runtimes.start()
+        self.addCleanup(runtimes.stop)
         
     def test_home_page(self):
         """Test home page loads correctly"""
@@ -31,12 +41,41 @@ class TestFlaskApp(unittest.TestCase):
         
     def test_health_check(self):
         """Test health check endpoint"""
-        response = self.app.get('/health')
+        with patch('app.model', MagicMock()):
+            response = self.app.get('/health')
         self.assertEqual(response.status_code, 200)
         data = json.loads(response.data)
         self.assertIn('status', data)
         self.assertEqual(data['status'], 'healthy')
         
+    def test_health_check_without_model(self):
+        """Test health check reports unhealthy when the model is not loaded"""
+        with patch('app.model', None):
+            response = self.app.get('/health')
+        self.assertEqual(response.status_code, 503)
+        data = json.loads(response.data)
+        self.assertEqual(data['status'], 'unhealthy')
+        self.assertFalse(data['model_loaded'])
+        
+    def test_load_model_with_missing_encoders(self):
+        """Test a partial set of artifacts leaves the model unloaded"""
+        from app import load_model
+        
+        fake_model = MagicMock()
+        fake_model.get_params.return_value = {}
+        
+        # Model pickle loads, but models/encoders.json cannot be opened
+        with patch.multiple('app', model=MagicMock(), label_encoders={}, encoder_maps={}), \
+             patch('app.joblib.load', return_value=fake_model), \
+             patch('app.MODEL_RUNTIME', 'sklearn'), \
+             patch('builtins.open', side_effect=FileNotFoundError('models/encoders.json')):
+            self.assertFalse(load_model())
+            
+            import app as app_module
+            self.assertIsNone(app_module.model)
+            self.assertEqual(app_module.encoder_maps, {})
+            self.assertEqual(self.app.get('/health').status_code, 503)
+        
     def test_model_info_without_model(self):
         """Test model info endpoint when model is not loaded"""
         with patch('app.model', None):
@@ -85,22 +124,22 @@ class TestFlaskApp(unittest.TestCase):
         mock_model.predict.return_value = [1]
         mock_model.predict_proba.return_value = [[0.3, 0.7]]
         
-        mock_encoders = {
-            'gender': MagicMock(),
-            'Partner': MagicMock(),
-            'Dependents': MagicMock(),
-            'PhoneService': MagicMock(),
-            'MultipleLines': MagicMock(),
-            'InternetService': MagicMock(),
-            'Contract': MagicMock()
+        mock_encoder_maps = {
+            'gender': {'Female': 0, 'Male': 1},
+            'Partner': {'No': 0, 'Yes': 1},
+            'Dependents': {'No': 0, 'Yes': 1},
+            'PhoneService': {'No': 0, 'Yes': 1},
+            'MultipleLines': {'No': 0, 'No phone service': 1, 'Yes': 2},
+            'InternetService': {'DSL': 0, 'Fiber optic': 1, 'No': 2},
+            'Contract': {'Month-to-month': 0, 'One year': 1, 'Two year': 2}
         }
         
-        mock_scaler = MagicMock()
-        mock_scaler.transform.return_value = np.array([[1, 2, 3, 4, 5]])
+        # Rebuild the lookup tables from the real encoder maps once the patch is gone
+        self.addCleanup(prepare_preprocessors)
         
         with patch('app.model', mock_model), \
-             patch('app.label_encoders', mock_encoders), \
-             patch('app.scaler', mock_scaler):
+             patch('app.encoder_maps', mock_encoder_maps):
+            prepare_preprocessors()
             
             test_data = {
                 'gender': 'Male',
@@ -111,7 +150,15 @@ class TestFlaskApp(unittest.TestCase):
                 'PhoneService': 'Yes',
                 'MultipleLines': 'No',
                 'InternetService': 'DSL',
+                'OnlineSecurity': 'No',
+                'OnlineBackup': 'No',
+                'DeviceProtection': 'No',
+                'TechSupport': 'No',
+                'StreamingTV': 'No',
+                'StreamingMovies': 'No',
                 'Contract': 'Month-to-month',
+                'PaperlessBilling': 'Yes',
+                'PaymentMethod': 'Electronic check',
                 'MonthlyCharges': 50.0,
                 'TotalCharges': 600.0
             }
@@ -124,6 +171,182 @@ class TestFlaskApp(unittest.TestCase):
             self.assertIn('prediction', data)
             self.assertIn('churn_probability', data)
             self.assertEqual(data['prediction'], 1)
+            
+    def test_predict_batch(self):
+        """Test batch prediction scores all rows with one model call"""
+        mock_model = MagicMock()
+        mock_model.predict_proba.return_value = np.array([[0.3, 0.7], [0.9, 0.1]])
+        
+        prepare_preprocessors()
+        
+        with patch('app.model', mock_model):
+            rows = [{'gender': 'Male', 'tenure': 1, 'MonthlyCharges': 80.0, 'TotalCharges': 80.0},
+                    {'gender': 'Female', 'tenure': 60, 'MonthlyCharges': 20.0,
+                     'TotalCharges': 1200.0}]
+            
+            response = self.app.post('/predict_batch', 
+                                   data=json.dumps({'rows': rows}),
+                                   content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            self.assertEqual([p['prediction'] for p in data['predictions']], [1, 0])
+            self.assertEqual(mock_model.predict_proba.call_count, 1)
+            self.assertEqual(mock_model.predict_proba.call_args[0][0].shape, (2, 21))
+            
+            # Batch rows must not take over the /predict cache
+            from app import _preprocess_cached
+            self.assertEqual(_preprocess_cached.cache_info().currsize, 0)
+            
+    def test_predict_batch_with_invalid_data(self):
+        """Test batch prediction rejects missing, oversized and bad rows"""
+        prepare_preprocessors()
+        
+        with patch('app.model', MagicMock()) as mock_model:
+            response = self.app.post('/predict_batch', 
+                                   data=json.dumps({'rows': []}),
+                                   content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            
+            # Second row has no TotalCharges
+            rows = [{'tenure': 1, 'TotalCharges': 10.0}, {'tenure': 2}]
+            response = self.app.post('/predict_batch', 
+                                   data=json.dumps({'rows': rows}),
+                                   content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('row 1', json.loads(response.data)['error'])
+            
+            with patch('app.MAX_BATCH_ROWS', 2):
+                response = self.app.post('/predict_batch', 
+                                       data=json.dumps({'rows': [{'TotalCharges': 1.0}] * 3}),
+                                       content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('Too many rows', json.loads(response.data)['error'])
+            
+            mock_model.predict_proba.assert_not_called()
+            
+    def test_preprocess_input_encoder_maps(self):
+        """Test categorical values are encoded with the prebuilt lookup tables"""
+        from app import preprocess_input
+        
+        encoder_maps = {'Contract': {'Month-to-month': 0, 'One year': 1, 'Two year': 2},
+                        'gender': {'Female': 0, 'Male': 1},
+                        'PhoneService': {'No': 0, 'Yes': 1},
+                        'OnlineSecurity': {'No': 0, 'No internet service': 1, 'Yes': 2},
+                        'OnlineBackup': {'No': 0, 'No internet service': 1, 'Yes': 2}}
+        
+        # Rebuild the lookup tables from the real encoder maps once the patch is gone
+        self.addCleanup(prepare_preprocessors)
+        
+        with patch('app.encoder_maps', encoder_maps):
+            prepare_preprocessors()
+            X = preprocess_input({'Contract': 'Two year', 'gender': 'Unknown',
+                                  'PhoneService': 'Yes', 'OnlineSecurity': 'Yes',
+                                  'OnlineBackup': 'No internet service',
+                                  'tenure': 5, 'MonthlyCharges': 20.0, 'TotalCharges': ' '})
+        
+        self.assertEqual(X.shape, (1, 21))
+        self.assertEqual(X[0, 16], 2)  # Contract
+        self.assertEqual(X[0, 4], 0)  # unknown gender falls back to 0
+        self.assertEqual(X[0, 3], 20.0)  # blank TotalCharges filled from MonthlyCharges
+        self.assertEqual(X[0, 19], 1)  # NEW_Engaged
+        self.assertEqual(X[0, 20], 2)  # NEW_TotalServices counts 'Yes' answers
+        
+    def test_popcount8(self):
+        """Test the SWAR popcount used for NEW_TotalServices"""
+        from app import _popcount8
+        
+        for v in range(256):
+            self.assertEqual(_popcount8(v), bin(v).count('1'))
+        
+    def test_predict_cache(self):
+        """Test repeated payloads are served from the cache"""
+        mock_model = MagicMock()
+        mock_model.predict_proba.return_value = [[0.8, 0.2]]
+        
+        from app import _preprocess_impl
+        
+        with patch('app.model', mock_model), \
+             patch('app._preprocess_impl', wraps=_preprocess_impl) as mock_preprocess:
+            prepare_preprocessors()
+            test_data = {'gender': 'Female', 'tenure': 3,
+                         'MonthlyCharges': 70.0, 'TotalCharges': 210.0}
+            
+            for _ in range(3):
+                response = self.app.post('/predict', 
+                                       data=json.dumps(test_data),
+                                       content_type='application/json')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(json.loads(response.data)['prediction'], 0)
+        
+        self.assertEqual(mock_preprocess.call_count, 1)
+        self.assertEqual(mock_model.predict_proba.call_count, 1)
+        
+    def test_predict_proba_onnx_runtime(self):
+        """Test the ONNX Runtime session is preferred over the sklearn model"""
+        from app import predict_proba
+        
+        mock_session = MagicMock()
+        mock_session.run.return_value = [np.array([[0.6, 0.4]], dtype=np.float32)]
+        X = np.zeros((1, 21), dtype=np.float32)
+        
+        with patch('app.model', MagicMock()) as mock_model, patch('app.onnx_session', mock_session):
+            probabilities = predict_proba(X)
+        
+        mock_session.run.assert_called_once_with(['probabilities'], {'input': X})
+        mock_model.predict_proba.assert_not_called()
+        self.assertAlmostEqual(float(probabilities[0, 1]), 0.4, places=6)
+        
+    def test_predict_proba_treelite(self):
+        """Test Treelite output for binary models is expanded to both classes"""
+        from app import predict_proba
+        
+        mock_predictor = MagicMock()
+        mock_predictor.predict.return_value = np.array([[[0.25]], [[0.9]]])
+        X = np.zeros((2, 21), dtype=np.float32)
+        
+        with patch('app.treelite_predictor', mock_predictor), patch('app.onnx_session', None):
+            probabilities = predict_proba(X)
+        
+        np.testing.assert_allclose(probabilities, [[0.75, 0.25], [0.1, 0.9]])
+        
+    def test_predict_proba_batched(self):
+        """Test queued rows are scored together and routed back to their callers"""
+        from app import predict_proba_batched, _batch_worker_loop
+        
+        mock_model = MagicMock()
+        # Churn probability of each row is taken from its first feature
+        mock_model.predict_proba.side_effect = lambda X: np.column_stack([1 - X[:, 0], X[:, 0]])
+        
+        # Non-blocking get lets the worker loop return once the queue is drained
+        requests = queue.Queue()
+        requests.get = partial(requests.get, block=False)
+        results = {}
+        
+        def score(value):
+            row = np.full((1, 21), value, dtype=np.float32)
+            results[value] = predict_proba_batched(row)
+        
+        with patch.multiple('app', model=mock_model, request_queue=requests,
+                            start_batch_worker=MagicMock()):
+            threads = [threading.Thread(target=score, args=(v,)) for v in (0.25, 0.5, 0.75)]
+            for t in threads:
+                t.start()
+            
+            # Every caller is waiting on the queue before the worker runs
+            deadline = time.monotonic() + 5
+            while requests.qsize() < 3 and time.monotonic() < deadline:
+                time.sleep(0.001)
+            self.assertEqual(requests.qsize(), 3)
+            
+            with self.assertRaises(queue.Empty):
+                _batch_worker_loop()
+            for t in threads:
+                t.join()
+        
+        self.assertEqual(mock_model.predict_proba.call_count, 1)
+        self.assertEqual(len(results), 3)
+        for value, probability in results.items():
+            self.assertAlmostEqual(float(probability[1]), value)
 
 class TestModelTraining(unittest.TestCase):
     """Test cases for model training"""
@@ -136,20 +359,25 @@ class TestModelTraining(unittest.TestCase):
         
     def test_feature_engineering(self):
         """Test feature engineering functions"""
-        # Create sample data
+        from model_training import feature_engineering
+        
+        # Create sample data (remaining service columns are all 'No')
         df = pd.DataFrame({
             'Contract': ['Month-to-month', 'One year', 'Two year'],
             'PhoneService': ['Yes', 'Yes', 'No'],
-            'OnlineSecurity': ['No', 'Yes', 'No']
+            'OnlineSecurity': ['No', 'Yes', 'No internet service']
         })
+        for col in ['OnlineBackup', 'DeviceProtection', 'TechSupport',
+                    'StreamingTV', 'StreamingMovies']:
+            df[col] = 'No'
+        
+        df = feature_engineering(df)
         
         # Test NEW_Engaged feature
-        df['NEW_Engaged'] = df['Contract'].apply(lambda x: 1 if x in ['One year','Two year'] else 0)
         expected_engaged = [0, 1, 1]
         self.assertEqual(df['NEW_Engaged'].tolist(), expected_engaged)
         
         # Test NEW_TotalServices feature
-        df['NEW_TotalServices'] = (df[['PhoneService', 'OnlineSecurity']]== 'Yes').sum(axis=1)
         expected_services = [1, 2, 0]
         self.assertEqual(df['NEW_TotalServices'].tolist(), expected_services)
 